@@ -1,6 +1,607 @@
+import functools
+import math
+
 import QuantLib as ql
 import numpy as np
 import scipy.optimize as opt
+from scipy.stats import norm, qmc
+from numba import njit, prange
+
+
+@njit(fastmath=True, cache=True)
+def _milstein_step(S, v, dt, drift, kappa, theta, sigma, rho, rho_complement, Z1, Z2):
+    """Advance the underlying price with a log-Euler step and the variance with a truncated Milstein step."""
+    Z2 = rho * Z1 + rho_complement * Z2
+    sqrt_v_dt = np.sqrt(v * dt)
+
+    S *= np.exp((drift - 0.5 * v) * dt + sqrt_v_dt * Z1)
+    v += kappa * (theta - v) * dt + sigma * sqrt_v_dt * Z2 + 0.25 * sigma ** 2 * dt * (Z2 ** 2 - 1.0)
+
+    return S, max(v, 0.0)
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _brownian_bridge(Z, dts):
+    """
+    Turn standard normals into the increments of Brownian paths built by a Brownian bridge.
+
+    The first normal of each factor fixes the terminal value and the following ones fill in
+    midpoints recursively, so the leading dimensions of a low-discrepancy sequence drive the
+    largest scale moves of the paths.
+
+    Args:
+        Z: Independent standard normal draws in bridge order, shape (num_paths, n_steps, n_factors)
+        dts: Length of each step, shape (n_steps,)
+
+    Returns:
+        Independent standard normal increments in time order, same shape as Z
+    """
+    num_paths, n_steps, n_factors = Z.shape
+    times = np.cumsum(dts)
+
+    # Construction order: each point is bridged between its nearest built neighbours
+    bridge_index = np.empty(n_steps, dtype=np.int64)
+    left_index = np.zeros(n_steps, dtype=np.int64)
+    right_index = np.zeros(n_steps, dtype=np.int64)
+    left_weight = np.zeros(n_steps)
+    right_weight = np.zeros(n_steps)
+    std_dev = np.empty(n_steps)
+    built = np.zeros(n_steps, dtype=np.bool_)
+
+    built[n_steps - 1] = True
+    bridge_index[0] = n_steps - 1
+    std_dev[0] = np.sqrt(times[n_steps - 1])
+    j = 0
+    for i in range(1, n_steps):
+        while built[j]:
+            j += 1
+        k = j
+        while not built[k]:
+            k += 1
+        l = j + (k - 1 - j) // 2
+        built[l] = True
+        bridge_index[i], left_index[i], right_index[i] = l, j, k
+
+        left_time = times[j - 1] if j > 0 else 0.0
+        left_weight[i] = (times[k] - times[l]) / (times[k] - left_time)
+        right_weight[i] = (times[l] - left_time) / (times[k] - left_time)
+        std_dev[i] = np.sqrt((times[l] - left_time) * (times[k] - times[l]) / (times[k] - left_time))
+
+        j = k + 1
+        if j >= n_steps:
+            j = 0
+
+    increments = np.empty_like(Z)
+    sqrt_dts = np.sqrt(dts)
+
+    for p in prange(num_paths):
+        path = np.empty(n_steps)
+        for f in range(n_factors):
+            path[n_steps - 1] = std_dev[0] * Z[p, 0, f]
+            for i in range(1, n_steps):
+                j, k = left_index[i], right_index[i]
+                left_value = path[j - 1] if j > 0 else 0.0
+                path[bridge_index[i]] = (left_weight[i] * left_value + right_weight[i] * path[k]
+                                         + std_dev[i] * Z[p, i, f])
+
+            increments[p, 0, f] = path[0] / sqrt_dts[0]
+            for t in range(1, n_steps):
+                increments[p, t, f] = (path[t] - path[t - 1]) / sqrt_dts[t]
+
+    return increments
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _heston_milstein(S0, v0, kappa, theta, sigma, rho, r, q, dts, Z, observation_steps):
+    """
+    Simulate Heston paths with a log-Euler scheme for the price and a Milstein scheme for the variance.
+
+    Args:
+        S0: Initial underlying price
+        v0: Initial variance
+        kappa: Mean reversion speed
+        theta: Long-term variance
+        sigma: Volatility of variance
+        rho: Correlation between price and variance
+        r: Continuously compounded risk-free forward rate of each step
+        q: Continuously compounded dividend forward rate of each step
+        dts: Length of each step, shape (n_steps,)
+        Z: Independent standard normal draws, shape (num_paths, n_steps, 2)
+        observation_steps: Number of steps elapsed at each observation time
+
+    Returns:
+        Underlying price at each observation time as float32, shape (num_paths, len(observation_steps)),
+        in Fortran order
+    """
+    num_paths, n_steps = Z.shape[0], Z.shape[1]
+    # Fortran order keeps each observation date contiguous for column-wise consumers. The stored
+    # prices are single precision, far below the Monte Carlo error, while each path evolves in double
+    paths = np.empty((observation_steps.shape[0], num_paths), dtype=np.float32).T
+    rho_complement = np.sqrt(1.0 - rho ** 2)
+
+    for i in prange(num_paths):
+        S = S0
+        v = v0
+        k = 0
+
+        for t in range(n_steps + 1):
+            while k < observation_steps.shape[0] and observation_steps[k] == t:
+                paths[i, k] = S
+                k += 1
+            if t == n_steps:
+                break
+
+            S, v = _milstein_step(
+                S, v, dts[t], r[t] - q[t], kappa, theta, sigma, rho, rho_complement, Z[i, t, 0], Z[i, t, 1]
+            )
+
+    return paths
+
+
+@njit(fastmath=True, cache=True)
+def _observation_payoff(underlying_level, is_final, unpaid_coupons, autocall_barrier, coupon_barrier,
+                        protection_barrier, coupon_rate, notional, memory_factor, final_redemption):
+    """
+    Apply the autocallable payoff rules on one observation date.
+
+    Returns:
+        Tuple of (payoff, has_been_called, unpaid_coupons)
+    """
+    coupon = notional * (coupon_rate * (1 + unpaid_coupons * memory_factor))
+
+    # Final observation date logic
+    if is_final:
+        if underlying_level >= coupon_barrier:
+            return notional + coupon, True, 0
+        elif underlying_level >= protection_barrier:
+            return notional, True, 0
+        return notional * final_redemption, True, 0
+
+    # Intermediate observation dates
+    if underlying_level >= autocall_barrier:
+        return notional + coupon, True, 0
+    elif underlying_level >= coupon_barrier:
+        return coupon, False, 0
+    return 0.0, False, unpaid_coupons + 1
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _price_paths(levels, discount_factors, autocall_barrier, coupon_barrier, protection_barrier,
+                 coupon_rate, notional, memory_factor, initial_unpaid_coupons, final_redemptions):
+    """
+    Evaluate the autocallable payoff state machine on every simulated path.
+
+    Args:
+        levels: Float32 underlying levels relative to strike on future dates, shape (num_paths, num_dates)
+        discount_factors: Discount factor of each future observation date
+        autocall_barrier: Autocall barrier relative to strike
+        coupon_barrier: Coupon barrier relative to strike
+        protection_barrier: Capital protection barrier relative to strike
+        coupon_rate: Coupon rate per observation
+        notional: Notional amount
+        memory_factor: 1 if unpaid coupons are remembered, 0 otherwise
+        initial_unpaid_coupons: Coupons missed on past fixings since the last coupon payment
+        final_redemptions: Redemption per unit notional of each path below the protection barrier
+
+    Returns:
+        Present value of each path
+    """
+    num_paths, num_dates = levels.shape
+    payoff_pvs = np.zeros(num_paths)
+
+    for i in prange(num_paths):
+        # Levels are single precision but present values accumulate in double
+        total_pv = 0.0
+        unpaid_coupons = initial_unpaid_coupons
+
+        for t in range(num_dates):
+            payoff, has_been_called, unpaid_coupons = _observation_payoff(
+                levels[i, t], t == num_dates - 1, unpaid_coupons, autocall_barrier, coupon_barrier,
+                protection_barrier, coupon_rate, notional, memory_factor, final_redemptions[i]
+            )
+            total_pv += payoff * discount_factors[t]
+            if has_been_called:
+                break
+
+        payoff_pvs[i] = total_pv
+
+    return payoff_pvs
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _simulate_and_price(S0, v0, kappa, theta, sigma, rho, r, q, dts, Z, observation_steps, inverse_strike,
+                        discount_factors, autocall_barrier, coupon_barrier, protection_barrier,
+                        coupon_rate, notional, memory_factor, initial_unpaid_coupons):
+    """
+    Simulate Heston paths and evaluate the autocallable payoff in a single pass.
+
+    Each path only keeps its current price, variance and coupon state, so no path matrix is stored.
+    The final redemption of paths below the protection barrier is left to the caller.
+
+    Args:
+        S0, v0, kappa, theta, sigma, rho, r, q, dts, Z: As for _heston_milstein
+        observation_steps: Number of steps elapsed at each future observation date
+        inverse_strike: Reciprocal of the strike price the barriers are expressed against
+        discount_factors, autocall_barrier, coupon_barrier, protection_barrier, coupon_rate,
+        notional, memory_factor, initial_unpaid_coupons: As for _price_paths
+
+    Returns:
+        Tuple of (present value of each path, final level of each path redeemed through the final
+        payoff formula and -1 otherwise)
+    """
+    num_paths, n_steps = Z.shape[0], Z.shape[1]
+    num_dates = observation_steps.shape[0]
+    payoff_pvs = np.zeros(num_paths)
+    final_levels = np.full(num_paths, -1.0)
+    rho_complement = np.sqrt(1.0 - rho ** 2)
+
+    for i in prange(num_paths):
+        S = S0
+        v = v0
+        total_pv = 0.0
+        unpaid_coupons = initial_unpaid_coupons
+        k = 0
+
+        for t in range(n_steps):
+            S, v = _milstein_step(
+                S, v, dts[t], r[t] - q[t], kappa, theta, sigma, rho, rho_complement, Z[i, t, 0], Z[i, t, 1]
+            )
+            if t + 1 < observation_steps[k]:
+                continue
+
+            underlying_level = S * inverse_strike
+            is_final = k == num_dates - 1
+            payoff, has_been_called, unpaid_coupons = _observation_payoff(
+                underlying_level, is_final, unpaid_coupons, autocall_barrier, coupon_barrier,
+                protection_barrier, coupon_rate, notional, memory_factor, 0.0
+            )
+            total_pv += payoff * discount_factors[k]
+            # Only paths redeemed through the final payoff formula, which is below both barriers
+            if is_final and underlying_level < coupon_barrier and underlying_level < protection_barrier:
+                final_levels[i] = underlying_level
+            if has_been_called:
+                break
+            k += 1
+
+        payoff_pvs[i] = total_pv
+
+    return payoff_pvs, final_levels
+
+
+@njit(fastmath=True, cache=True)
+def _heston_cf(u, tau, v0, kappa, theta, sigma, rho, r, q):
+    """
+    Characteristic function of the log-return ln(S_T / S_0) under the Heston model.
+
+    Uses the "little Heston trap" formulation, which stays on the principal branch of the logarithm.
+
+    Args:
+        u: Complex evaluation points
+        tau: Time to maturity in years, or a column of maturities to evaluate a (maturity, u) grid
+        v0, kappa, theta, sigma, rho: Heston parameters
+        r: Continuously compounded risk-free rate, scalar or per maturity like tau
+        q: Continuously compounded dividend yield, scalar or per maturity like tau
+
+    Returns:
+        Characteristic function evaluated at u
+    """
+    xi = kappa - rho * sigma * 1j * u
+    d = np.sqrt(xi ** 2 + sigma ** 2 * (u ** 2 + 1j * u))
+    g = (xi - d) / (xi + d)
+    exp_d = np.exp(-d * tau)
+
+    D = (xi - d) / sigma ** 2 * (1.0 - exp_d) / (1.0 - g * exp_d)
+    C = kappa * theta / sigma ** 2 * ((xi - d) * tau - 2.0 * np.log((1.0 - g * exp_d) / (1.0 - g)))
+
+    return np.exp(1j * u * (r - q) * tau + C + D * v0)
+
+
+@njit(fastmath=True, cache=True)
+def _heston_cf_gradient(u, tau, v0, kappa, theta, sigma, rho, r, q):
+    """
+    Characteristic function of ln(S_T / S_0) and its analytic derivatives with respect to the parameters.
+
+    Args:
+        u: Complex evaluation points
+        tau: Time to maturity in years, or a column of maturities to evaluate a (maturity, u) grid
+        v0, kappa, theta, sigma, rho: Heston parameters
+        r: Continuously compounded risk-free rate, scalar or per maturity like tau
+        q: Continuously compounded dividend yield, scalar or per maturity like tau
+
+    Returns:
+        Tuple of (characteristic function, derivatives of shape (5,) + cf.shape in QuantLib
+        parameter order [theta, kappa, sigma, rho, v0])
+    """
+    iu = 1j * u
+    b = u ** 2 + iu
+    xi = kappa - rho * sigma * iu
+    d = np.sqrt(xi ** 2 + sigma ** 2 * b)
+    A = xi - d
+    B = xi + d
+    g = A / B
+    exp_d = np.exp(-d * tau)
+    G = 1.0 - g * exp_d
+    H = 1.0 - g
+    scale = kappa * theta / sigma ** 2
+
+    D = A / sigma ** 2 * (1.0 - exp_d) / G
+    C = scale * (A * tau - 2.0 * np.log(G / H))
+    cf = np.exp(iu * (r - q) * tau + C + D * v0)
+
+    gradient = np.empty((5,) + cf.shape, dtype=np.complex128)
+    gradient[0] = C / theta
+    gradient[4] = D
+
+    # kappa, sigma and rho enter through xi and d
+    for k in range(3):
+        if k == 0:
+            d_xi, d_sigma, d_kappa = np.ones_like(iu), 0.0, 1.0
+        elif k == 1:
+            d_xi, d_sigma, d_kappa = -rho * iu, 1.0, 0.0
+        else:
+            d_xi, d_sigma, d_kappa = -sigma * iu, 0.0, 0.0
+
+        d_d = (xi * d_xi + sigma * b * d_sigma) / d
+        d_A = d_xi - d_d
+        d_g = (d_A * B - A * (d_xi + d_d)) / B ** 2
+        d_exp_d = -tau * exp_d * d_d
+        d_G = -(d_g * exp_d + g * d_exp_d)
+
+        d_D = ((d_A * (1.0 - exp_d) - A * d_exp_d) / G - A * (1.0 - exp_d) * d_G / G ** 2) / sigma ** 2
+        d_D -= 2.0 * D / sigma * d_sigma
+        d_C = scale * (d_A * tau - 2.0 * (d_G / G + d_g / H))
+        d_C += C * (d_kappa / kappa - 2.0 * d_sigma / sigma)
+
+        gradient[k + 1] = d_C + d_D * v0
+
+    for k in range(5):
+        gradient[k] *= cf
+
+    return cf, gradient
+
+
+def _lewis_fft_prices(spot, strikes, maturities, v0, kappa, theta, sigma, rho, risk_free_rates, dividend_yields,
+                      num_points=4096, grid_spacing=0.1, gradient=False):
+    """
+    Price European calls on a strike-maturity grid with Lewis' formula evaluated by FFT.
+
+    Integrating along Im(u) = -1/2 only needs the moment E[S_T^(1/2)], which is finite for any
+    Heston parameters, unlike the damped Carr-Madan integrand. All maturities are transformed
+    together, one row of the same FFT each.
+
+    Args:
+        spot: Current underlying price
+        strikes: Array of strikes
+        maturities: Array of times to maturity in years
+        v0, kappa, theta, sigma, rho: Heston parameters
+        risk_free_rates: Continuously compounded risk-free rate to each maturity
+        dividend_yields: Continuously compounded dividend yield to each maturity
+        num_points: Number of FFT points
+        grid_spacing: Spacing of the integration grid
+        gradient: Also return the derivatives of the prices with respect to the parameters
+
+    Returns:
+        Array of call prices of shape (len(maturities), len(strikes)), and if requested their
+        derivatives of shape (5, len(maturities), len(strikes)) in QuantLib parameter order
+        [theta, kappa, sigma, rho, v0]
+    """
+    v = grid_spacing * np.arange(num_points)
+    log_strike_spacing = 2.0 * np.pi / (num_points * grid_spacing)
+    lower_log_strike = -0.5 * num_points * log_strike_spacing
+
+    tau = np.asarray(maturities, dtype=np.float64)[:, np.newaxis]
+    r = np.asarray(risk_free_rates, dtype=np.float64)[:, np.newaxis]
+    q = np.asarray(dividend_yields, dtype=np.float64)[:, np.newaxis]
+
+    # The prices are linear in the characteristic function, so its derivatives share the same transform
+    if gradient:
+        cf, cf_gradient = _heston_cf_gradient(v - 0.5j, tau, v0, kappa, theta, sigma, rho, r, q)
+        transforms = np.concatenate((cf[np.newaxis], cf_gradient))
+    else:
+        transforms = _heston_cf(v - 0.5j, tau, v0, kappa, theta, sigma, rho, r, q)[np.newaxis]
+    psi = np.exp(-r * tau) * transforms / (v ** 2 + 0.25)
+
+    # Simpson's rule weights
+    weights = grid_spacing / 3.0 * (3.0 + (-1.0) ** (np.arange(num_points) + 1))
+    weights[0] = grid_spacing / 3.0
+
+    log_strikes = lower_log_strike + log_strike_spacing * np.arange(num_points)
+    transformed = np.fft.fft(np.exp(-1j * lower_log_strike * v) * psi * weights, axis=-1).real
+    integrals = np.exp(0.5 * log_strikes) / np.pi * transformed
+
+    # Cubic Lagrange interpolation between the four nearest log-strike nodes
+    position = (np.log(strikes / spot) - lower_log_strike) / log_strike_spacing
+    index = np.floor(position).astype(np.int64)
+    t = position - index
+    interpolated = (-t * (t - 1.0) * (t - 2.0) / 6.0 * integrals[..., index - 1]
+                    + (t + 1.0) * (t - 1.0) * (t - 2.0) / 2.0 * integrals[..., index]
+                    - (t + 1.0) * t * (t - 2.0) / 2.0 * integrals[..., index + 1]
+                    + (t + 1.0) * t * (t - 1.0) / 6.0 * integrals[..., index + 2])
+
+    prices = spot * (np.exp(-q * tau) - interpolated[0])
+    if gradient:
+        return prices, -spot * interpolated[1:]
+    return prices
+
+
+@njit(cache=True)
+def _black_scholes_call(spot, strike, tau, vol, r, q):
+    """Black-Scholes call price and vega."""
+    sqrt_tau = np.sqrt(tau)
+    d1 = (np.log(spot / strike) + (r - q + 0.5 * vol ** 2) * tau) / (vol * sqrt_tau)
+    d2 = d1 - vol * sqrt_tau
+    forward_discount = spot * np.exp(-q * tau)
+    price = (forward_discount * 0.5 * (1.0 + math.erf(d1 / np.sqrt(2.0)))
+             - strike * np.exp(-r * tau) * 0.5 * (1.0 + math.erf(d2 / np.sqrt(2.0))))
+    vega = forward_discount * sqrt_tau * np.exp(-0.5 * d1 ** 2) / np.sqrt(2.0 * np.pi)
+    return price, vega
+
+
+def _black_scholes_vegas(spot, strikes, taus, vols, r, q):
+    """Black-Scholes vegas of an array of options."""
+    sqrt_tau = np.sqrt(taus)
+    d1 = (np.log(spot / strikes) + (r - q + 0.5 * vols ** 2) * taus) / (vols * sqrt_tau)
+    return spot * np.exp(-q * taus) * sqrt_tau * norm.pdf(d1)
+
+
+@njit(cache=True)
+def _implied_vols(prices, spot, strikes, taus, r, q, min_vol=1e-4, max_vol=5.0, tolerance=1e-10,
+                  max_iterations=100):
+    """
+    Invert Black-Scholes call prices with a bracketed Newton method.
+
+    Each price has its own strike, maturity and rates, so a whole surface is inverted in one call.
+    Prices outside the no-arbitrage range give the nearest volatility bound.
+
+    Returns:
+        Array of implied volatilities
+    """
+    vols = np.empty(prices.shape[0])
+
+    for i in range(prices.shape[0]):
+        lower, upper = min_vol, max_vol
+        vol = 0.3
+
+        for _ in range(max_iterations):
+            price, vega = _black_scholes_call(spot, strikes[i], taus[i], vol, r[i], q[i])
+            error = price - prices[i]
+            if abs(error) < tolerance:
+                break
+            if error > 0.0:
+                upper = vol
+            else:
+                lower = vol
+
+            # Newton step, falling back to bisection when it leaves the bracket
+            vol = vol - error / vega if vega > 0.0 else -1.0
+            if not lower < vol < upper:
+                vol = 0.5 * (lower + upper)
+
+        vols[i] = vol
+
+    return vols
+
+
+def _surface_options(maturities, strikes, risk_free_rates, dividend_yields):
+    """Flatten a strike-maturity grid into per-option strikes, maturities and rates, maturity-major."""
+    n_strikes = strikes.shape[0]
+    return (np.tile(strikes, maturities.shape[0]), np.repeat(maturities, n_strikes),
+            np.repeat(risk_free_rates, n_strikes), np.repeat(dividend_yields, n_strikes))
+
+
+def _surface_residuals(params, spot, maturities, strikes, market_vols, risk_free_rates, dividend_yields):
+    """
+    Implied volatility error of the Heston model across a volatility surface.
+
+    Args:
+        params: Heston parameters in QuantLib order [theta, kappa, sigma, rho, v0]
+        spot: Current underlying price
+        maturities: Time to each expiration in years
+        strikes: Array of strikes
+        market_vols: Market implied volatilities, shape (len(maturities), len(strikes))
+        risk_free_rates: Zero rate to each expiration
+        dividend_yields: Dividend zero rate to each expiration
+
+    Returns:
+        Flattened array of model minus market implied volatilities
+    """
+    theta, kappa, sigma, rho, v0 = params
+    prices = _lewis_fft_prices(spot, strikes, maturities, v0, kappa, theta, sigma, rho,
+                               risk_free_rates, dividend_yields)
+    model_vols = _implied_vols(prices.ravel(), spot,
+                               *_surface_options(maturities, strikes, risk_free_rates, dividend_yields))
+
+    return model_vols - market_vols.ravel()
+
+
+def _surface_jacobian(params, spot, maturities, strikes, market_vols, risk_free_rates, dividend_yields):
+    """
+    Analytic Jacobian of the surface residuals with respect to the Heston parameters.
+
+    Returns:
+        Array of shape (market_vols.size, 5)
+    """
+    theta, kappa, sigma, rho, v0 = params
+    prices, price_gradients = _lewis_fft_prices(spot, strikes, maturities, v0, kappa, theta, sigma, rho,
+                                                risk_free_rates, dividend_yields, gradient=True)
+    options = _surface_options(maturities, strikes, risk_free_rates, dividend_yields)
+    model_vols = _implied_vols(prices.ravel(), spot, *options)
+    option_strikes, option_maturities, option_rates, option_yields = options
+    vegas = _black_scholes_vegas(spot, option_strikes, option_maturities, model_vols, option_rates, option_yields)
+
+    # Implied volatilities clamped at their bounds carry no gradient
+    price_gradients = price_gradients.reshape(5, -1)
+    return np.divide(price_gradients, vegas, out=np.zeros_like(price_gradients), where=vegas > 1e-12).T
+
+
+def _surface_objective(params, **surface):
+    """Objective function for calibration optimization."""
+    errors = _surface_residuals(params, **surface)
+    return float(errors @ errors)
+
+
+# QuantLib objects cannot be pickled, so each worker process builds its own helpers on first use.
+# Only the market being calibrated is kept, so recalibrating on new quotes does not accumulate helpers.
+@functools.lru_cache(maxsize=1)
+def _calibration_helpers(market_key):
+    """
+    Build the Heston model and calibration helpers of a market, once per process and market.
+
+    Args:
+        market_key: Tuple of (valuation serial number, spot price, risk-free rate, dividend yield,
+            expiration serial numbers, strikes, volatilities) using only picklable values
+
+    Returns:
+        Tuple of (heston_model, calibration_helpers)
+    """
+    valuation_serial, spot_price, risk_free_rate, dividend_yield, expiration_serials, strikes, volatilities = market_key
+    valuation_date = ql.Date(valuation_serial)
+    # Helper maturities are given in days: count calendar days so they land on the expiries
+    calendar = ql.NullCalendar()
+    day_counter = ql.Actual360()
+    ql.Settings.instance().evaluationDate = valuation_date
+
+    risk_free_curve = ql.YieldTermStructureHandle(ql.FlatForward(valuation_date, risk_free_rate, day_counter))
+    dividend_curve = ql.YieldTermStructureHandle(ql.FlatForward(valuation_date, dividend_yield, day_counter))
+
+    # Any starting point will do, parameters are overwritten on every evaluation
+    heston_process = ql.HestonProcess(
+        risk_free_curve, dividend_curve, ql.QuoteHandle(ql.SimpleQuote(spot_price)),
+        0.01, 0.5, 0.01, 0.2, -0.5
+    )
+    heston_model = ql.HestonModel(heston_process)
+    pricing_engine = ql.AnalyticHestonEngine(heston_model)
+
+    calibration_helpers = []
+    for expiration_serial, market_vols in zip(expiration_serials, volatilities):
+        period = ql.Period(expiration_serial - valuation_serial, ql.Days)
+        for strike, market_vol in zip(strikes, market_vols):
+            helper = ql.HestonModelHelper(
+                period, calendar, spot_price, strike,
+                ql.QuoteHandle(ql.SimpleQuote(market_vol)),
+                risk_free_curve, dividend_curve
+            )
+            helper.setPricingEngine(pricing_engine)
+            calibration_helpers.append(helper)
+
+    return heston_model, calibration_helpers
+
+
+def _calibration_residuals(params, market_key):
+    """Calibration error of every helper for a set of Heston parameters."""
+    heston_model, calibration_helpers = _calibration_helpers(market_key)
+    parameters = ql.Array(np.asarray(params, dtype=np.float64).tolist())
+    heston_model.setParams(parameters)
+    return np.fromiter(
+        (helper.calibrationError() for helper in calibration_helpers),
+        dtype=np.float64, count=len(calibration_helpers)
+    )
+
+
+def _calibration_objective(params, market_key):
+    """Objective function for calibration optimization."""
+    errors = _calibration_residuals(params, market_key)
+    return float(errors @ errors)
 
 
 class HestonPricer:
@@ -22,6 +623,8 @@ class HestonPricer:
         self.valuation_date = valuation_date
         self.spot_price = spot_price
         self.strike_price = strike_price
+        self.risk_free_rate = risk_free_rate
+        self.dividend_yield = dividend_yield
         self.calendar = ql.TARGET()
         self.day_counter = ql.Actual360()
 
@@ -36,49 +639,142 @@ class HestonPricer:
             ql.FlatForward(valuation_date, dividend_yield, self.day_counter)
         )
 
-    def generate_paths(self, observation_dates, heston_process, num_paths):
+        # Simulation grids only depend on the observation dates, so repeated pricings reuse them
+        self._time_grid_cache = {}
+        self._milstein_grid_cache = {}
+
+    def generate_paths(self, observation_dates, heston_process, num_paths, use_quantlib=False, steps_per_year=52,
+                       seed=None):
         """
         Generate Monte Carlo paths using the Heston model.
 
         Args:
             observation_dates: List of dates for path observations
-            heston_process: Calibrated Heston process
-            num_paths: Number of Monte Carlo paths to generate
+            heston_process: Calibrated Heston process, whose curves set the drift
+            num_paths: Number of Monte Carlo paths to generate, a power of two to keep the Sobol sequence balanced
+            use_quantlib: Use QuantLib's path generator instead of the compiled Milstein scheme
+            steps_per_year: Minimum number of Milstein time steps per year between observations
+            seed: Seed of the Sobol scrambling of the Milstein generator, unused with use_quantlib
 
         Returns:
-            Array of simulated paths
+            Float32 array of simulated paths of shape (num_paths, len(observation_dates)), in Fortran
+            order so that the levels on each date are contiguous
         """
-        time_grid = np.array([
-            self.day_counter.yearFraction(observation_dates[0], date)
-            for date in observation_dates
-        ])
+        if use_quantlib:
+            return self._generate_quantlib_paths(self._time_grid(observation_dates), heston_process, num_paths)
 
-        grid_steps = (time_grid.shape[0] - 1) * 2
-        uniform_generator = ql.UniformRandomSequenceGenerator(
-            grid_steps, ql.UniformRandomGenerator()
+        dts, r, q, observation_steps = self._milstein_grid(observation_dates, steps_per_year, heston_process)
+        Z = self._sobol_antithetic_normals(num_paths, dts, seed)
+
+        return _heston_milstein(*self._heston_parameters(heston_process), r, q, dts, Z, observation_steps)
+
+    def _time_grid(self, observation_dates):
+        """Year fractions of the observation dates from the first one."""
+        key = tuple(date.serialNumber() for date in observation_dates)
+        if key not in self._time_grid_cache:
+            self._time_grid_cache[key] = np.array([
+                self.day_counter.yearFraction(observation_dates[0], date)
+                for date in observation_dates
+            ])
+        return self._time_grid_cache[key]
+
+    def _milstein_grid(self, observation_dates, steps_per_year, heston_process):
+        """
+        Refine each observation interval into equal Milstein steps.
+
+        The step layout is cached per set of observation dates. The forward rates are read from the
+        curves of the process on every call, like QuantLib's own path generator does.
+
+        Returns:
+            Tuple of (step lengths, risk-free forward rates, dividend forward rates,
+            number of steps elapsed at each observation time)
+        """
+        key = (tuple(date.serialNumber() for date in observation_dates), steps_per_year)
+        if key not in self._milstein_grid_cache:
+            time_grid = self._time_grid(observation_dates)
+            steps = np.maximum(np.ceil(np.diff(time_grid) * steps_per_year), 1).astype(np.int64)
+            observation_steps = np.concatenate((np.zeros(1, dtype=np.int64), np.cumsum(steps)))
+            step_times = np.concatenate([
+                np.linspace(start, end, n, endpoint=False)
+                for start, end, n in zip(time_grid[:-1], time_grid[1:], steps)
+            ] + [time_grid[-1:]])
+            self._milstein_grid_cache[key] = step_times, observation_steps
+        step_times, observation_steps = self._milstein_grid_cache[key]
+        dts = np.diff(step_times)
+
+        # Forward rates over each step
+        risk_free_curve, dividend_curve = heston_process.riskFreeRate(), heston_process.dividendYield()
+        risk_free_discounts = np.fromiter(
+            (risk_free_curve.discount(t) for t in step_times), dtype=np.float64, count=step_times.shape[0]
         )
-        gaussian_generator = ql.GaussianRandomSequenceGenerator(uniform_generator)
-        path_generator = ql.GaussianMultiPathGenerator(
+        dividend_discounts = np.fromiter(
+            (dividend_curve.discount(t) for t in step_times), dtype=np.float64, count=step_times.shape[0]
+        )
+        r = np.log(risk_free_discounts[:-1] / risk_free_discounts[1:]) / dts
+        q = np.log(dividend_discounts[:-1] / dividend_discounts[1:]) / dts
+
+        return dts, r, q, observation_steps
+
+    @staticmethod
+    def _heston_parameters(heston_process):
+        """Initial state and parameters of a Heston process as (S0, v0, kappa, theta, sigma, rho)."""
+        heston_model = ql.HestonModel(heston_process)
+        spot, v0 = heston_process.initialValues()
+        return spot, v0, heston_model.kappa(), heston_model.theta(), heston_model.sigma(), heston_model.rho()
+
+    def _sobol_antithetic_normals(self, num_paths, dts, seed):
+        """
+        Draw standard normals from a scrambled Sobol sequence, paired with their antithetic values.
+
+        The Sobol dimensions are assigned to the time steps through a Brownian bridge. The balance
+        properties of the sequence hold when the number of pairs is a power of two.
+
+        Returns:
+            Array of shape (num_paths, len(dts), 2)
+        """
+        n_steps = dts.shape[0]
+        num_pairs = (num_paths + 1) // 2
+        sobol = qmc.Sobol(d=n_steps * 2, scramble=True, seed=seed)
+        uniforms = sobol.random(num_pairs)
+        Z = _brownian_bridge(norm.ppf(uniforms).reshape(num_pairs, n_steps, 2), dts)
+
+        return np.concatenate((Z, -Z))[:num_paths]
+
+    def _generate_quantlib_paths(self, time_grid, heston_process, num_paths):
+        """
+        Generate Monte Carlo paths with QuantLib's multi-path generator.
+
+        Paths are driven by an unscrambled, deterministic Sobol sequence. QuantLib's multi-path
+        generator does not support Brownian bridge construction, so the dimensions follow the time steps.
+        """
+        grid_steps = (time_grid.shape[0] - 1) * 2
+        uniform_generator = ql.UniformLowDiscrepancySequenceGenerator(grid_steps)
+        gaussian_generator = ql.GaussianLowDiscrepancySequenceGenerator(uniform_generator)
+        path_generator = ql.GaussianSobolMultiPathGenerator(
             heston_process, time_grid, gaussian_generator, False
         )
 
-        paths = np.zeros(shape=(num_paths, time_grid.shape[0]))
+        paths = np.zeros(shape=(num_paths, time_grid.shape[0]), dtype=np.float32, order='F')
 
         for i in range(num_paths):
             multi_path = path_generator.next().value()
-            paths[i, :] = np.array(list(multi_path[0]))
+            paths[i, :] = np.fromiter(multi_path[0], dtype=np.float32, count=time_grid.shape[0])
 
         return paths
 
-    def calibrate_heston_model(self, market_data, initial_params, parameter_bounds, optimizer=opt.differential_evolution):
+    def calibrate_heston_model(self, market_data, initial_params, parameter_bounds, optimizer=opt.differential_evolution,
+                               global_search_options=None, use_quantlib=False):
         """
         Calibrate the Heston model to market volatility data.
 
         Args:
             market_data: Dictionary with 'expiration_dates', 'strikes', and 'volatilities'
             initial_params: Initial guess for Heston parameters [v0, kappa, theta, sigma, rho]
-            parameter_bounds: Bounds for optimization
-            optimizer: Optimization algorithm to use
+            parameter_bounds: Bounds for optimization, in QuantLib order [theta, kappa, sigma, rho, v0]
+            optimizer: Global optimization algorithm used to seed the least-squares fit
+            global_search_options: Keyword arguments for the global optimizer. Defaults to a coarse
+                search for differential evolution and to no options for any other optimizer
+            use_quantlib: Fit QuantLib calibration helpers instead of the FFT implied volatility surface
 
         Returns:
             Tuple of (calibrated_process, calibrated_model)
@@ -92,45 +788,73 @@ class HestonPricer:
             v0, kappa, theta, sigma, rho
         )
         heston_model = ql.HestonModel(heston_process)
-        pricing_engine = ql.AnalyticHestonEngine(heston_model)
-
-        # Create calibration helpers
-        calibration_helpers = []
-
-        for i, expiration_date in enumerate(market_data['expiration_dates']):
-            for j, strike in enumerate(market_data['strikes']):
-                days_to_expiry = expiration_date - self.valuation_date
-                period = ql.Period(days_to_expiry, ql.Days)
-                market_vol = market_data['volatilities'][i][j]
-
-                helper = ql.HestonModelHelper(
-                    period, self.calendar, self.spot_price, strike,
-                    ql.QuoteHandle(ql.SimpleQuote(market_vol)),
-                    self.risk_free_curve, self.dividend_curve
-                )
-                helper.setPricingEngine(pricing_engine)
-                calibration_helpers.append(helper)
-
-        def objective_function(params):
-            """Objective function for calibration optimization."""
-            parameters = ql.Array(list(params))
-            heston_model.setParams(parameters)
-            errors = [helper.calibrationError() for helper in calibration_helpers]
-            return np.sqrt(np.sum(np.abs(errors)))
-
-        # Run optimization
-        optimizer(objective_function, parameter_bounds)
-
-        return heston_process, heston_model
-
-    def price_autocallable_note(self, product_specs, heston_process, num_paths=10000):
+
+        expiration_dates = list(market_data['expiration_dates'])
+        strikes = np.array(market_data['strikes'], dtype=float)
+        market_vols = np.array(market_data['volatilities'], dtype=float)
+
+        if use_quantlib:
+            # Market data as plain values, so the objective can be evaluated in worker processes
+            market_key = (
+                self.valuation_date.serialNumber(), self.spot_price, self.risk_free_rate, self.dividend_yield,
+                tuple(date.serialNumber() for date in expiration_dates),
+                tuple(strikes.tolist()),
+                tuple(map(tuple, market_vols.tolist()))
+            )
+            residuals = functools.partial(_calibration_residuals, market_key=market_key)
+            jacobian = '2-point'
+            objective_function = functools.partial(_calibration_objective, market_key=market_key)
+        else:
+            maturities = np.array([
+                self.day_counter.yearFraction(self.valuation_date, date) for date in expiration_dates
+            ])
+            surface = {
+                'spot': self.spot_price,
+                'maturities': maturities,
+                'strikes': strikes,
+                'market_vols': market_vols,
+                'risk_free_rates': np.array([
+                    self.risk_free_curve.zeroRate(tau, ql.Continuous).rate() for tau in maturities
+                ]),
+                'dividend_yields': np.array([
+                    self.dividend_curve.zeroRate(tau, ql.Continuous).rate() for tau in maturities
+                ]),
+            }
+            residuals = functools.partial(_surface_residuals, **surface)
+            jacobian = functools.partial(_surface_jacobian, **surface)
+            objective_function = functools.partial(_surface_objective, **surface)
+
+        # Coarse global search, then a local least-squares fit seeded by its best point.
+        # Each objective evaluation takes milliseconds, so the search runs serially unless
+        # the caller opts in to worker processes.
+        if global_search_options is None:
+            if optimizer is opt.differential_evolution:
+                global_search_options = {'popsize': 5, 'maxiter': 20, 'polish': False}
+            else:
+                global_search_options = {}
+        global_result = optimizer(objective_function, parameter_bounds, **global_search_options)
+
+        lower_bounds, upper_bounds = np.array(parameter_bounds, dtype=float).T
+        local_result = opt.least_squares(
+            residuals, np.clip(global_result.x, lower_bounds, upper_bounds), jac=jacobian,
+            bounds=(lower_bounds, upper_bounds), method='trf'
+        )
+        heston_model.setParams(ql.Array(list(local_result.x)))
+
+        return heston_model.process(), heston_model
+
+    def price_autocallable_note(self, product_specs, heston_process, num_paths=8192, use_quantlib=False,
+                                steps_per_year=52, seed=None):
         """
         Price an autocallable note using Monte Carlo simulation.
 
         Args:
             product_specs: Dictionary containing product specifications
-            heston_process: Calibrated Heston process
-            num_paths: Number of Monte Carlo paths
+            heston_process: Calibrated Heston process, whose curves set the drift
+            num_paths: Number of Monte Carlo paths, a power of two to keep the Sobol sequence balanced
+            use_quantlib: Price on paths from QuantLib's path generator instead of the fused Milstein kernel
+            steps_per_year: Minimum number of Milstein time steps per year between observations
+            seed: Seed of the Sobol scrambling of the Milstein generator, unused with use_quantlib
 
         Returns:
             Present value of the autocallable note
@@ -157,61 +881,61 @@ class HestonPricer:
         future_dates = coupon_dates[coupon_dates > self.valuation_date]
         observation_dates = np.hstack((np.array([self.valuation_date]), future_dates))
 
-        # Generate Monte Carlo paths
-        paths = self.generate_paths(observation_dates, heston_process, num_paths)[:, 1:]
+        # Discount factors only depend on the observation date
+        discount_factors = np.fromiter(
+            (self.risk_free_curve.discount(date) for date in future_dates),
+            dtype=np.float64, count=len(future_dates)
+        )
 
-        # Include past fixings if any
+        # Past fixings are the same on every path: they can no longer autocall the note and their
+        # coupons are settled, so they only carry unpaid coupons into the simulated dates
         past_dates = coupon_dates[coupon_dates <= self.valuation_date]
-        if past_dates.shape[0] > 0:
-            past_fixings_array = np.array([past_fixings[date] for date in past_dates])
-            past_fixings_array = np.tile(past_fixings_array, (paths.shape[0], 1))
-            paths = np.hstack((past_fixings_array, paths))
-
-        # Calculate payoffs for each path
-        payoff_pvs = []
-        expiration_date = coupon_dates[-1]
-        memory_factor = int(has_memory)
+        initial_unpaid_coupons = 0
+        for date in past_dates:
+            if past_fixings[date] >= coupon_barrier * self.strike_price:
+                initial_unpaid_coupons = 0
+            else:
+                initial_unpaid_coupons += 1
 
-        for path in paths:
-            total_pv = 0.0
-            unpaid_coupons = 0
-            has_been_called = False
-
-            for observation_date, underlying_level in zip(coupon_dates, (path / self.strike_price)):
-                if has_been_called:
-                    break
+        memory_factor = int(has_memory)
+        inverse_strike = 1.0 / self.strike_price
 
-                payoff = 0.0
+        if use_quantlib:
+            paths = self.generate_paths(observation_dates, heston_process, num_paths, use_quantlib=True)[:, 1:]
+            levels = paths * np.float32(inverse_strike)
 
-                # Final observation date logic
-                if observation_date == expiration_date:
-                    if underlying_level >= coupon_barrier:
-                        payoff = notional * (1 + (coupon_rate * (1 + unpaid_coupons * memory_factor)))
-                    elif underlying_level >= protection_barrier:
-                        payoff = notional
-                    else:
-                        actual_level = underlying_level * self.strike_price
-                        payoff = notional * final_payoff_formula(actual_level)
+            # The custom final payoff cannot be compiled, so evaluate it up front where it applies
+            final_levels = levels[:, -1]
+            below_protection = final_levels < np.float32(protection_barrier)
+            final_redemptions = np.ones(levels.shape[0])
+            final_redemptions[below_protection] = [
+                final_payoff_formula(level * self.strike_price) for level in final_levels[below_protection]
+            ]
 
-                # Intermediate observation dates
-                else:
-                    if underlying_level >= autocall_barrier:
-                        payoff = notional * (1 + (coupon_rate * (1 + unpaid_coupons * memory_factor)))
-                        has_been_called = True
-                    elif underlying_level >= coupon_barrier:
-                        payoff = notional * (coupon_rate * (1 + unpaid_coupons * memory_factor))
-                        unpaid_coupons = 0
-                    else:
-                        unpaid_coupons += 1
+            # Compare single precision levels against barriers of the same precision
+            payoff_pvs = _price_paths(
+                levels, discount_factors, np.float32(autocall_barrier), np.float32(coupon_barrier),
+                np.float32(protection_barrier), coupon_rate, notional, memory_factor, initial_unpaid_coupons,
+                final_redemptions
+            )
+        else:
+            # Simulate and price in one pass, without storing the paths
+            dts, r, q, observation_steps = self._milstein_grid(observation_dates, steps_per_year, heston_process)
+            Z = self._sobol_antithetic_normals(num_paths, dts, seed)
 
-                # Discount payoff to present value
-                if observation_date > self.valuation_date:
-                    discount_factor = self.risk_free_curve.discount(observation_date)
-                    total_pv += payoff * discount_factor
+            payoff_pvs, final_levels = _simulate_and_price(
+                *self._heston_parameters(heston_process), r, q, dts, Z, observation_steps[1:], inverse_strike,
+                discount_factors, autocall_barrier, coupon_barrier, protection_barrier,
+                coupon_rate, notional, memory_factor, initial_unpaid_coupons
+            )
 
-            payoff_pvs.append(total_pv)
+            # The custom final payoff cannot be compiled, so apply it to the paths that need it
+            below_protection = final_levels >= 0.0
+            payoff_pvs[below_protection] += discount_factors[-1] * notional * np.array([
+                final_payoff_formula(level * self.strike_price) for level in final_levels[below_protection]
+            ])
 
-        return np.mean(np.array(payoff_pvs))
+        return np.mean(payoff_pvs)
 
 
 def main_example():
@@ -275,7 +999,7 @@ def main_example():
         pricer.calendar, ql.ModifiedFollowing, ql.ModifiedFollowing,
         ql.DateGeneration.Forward, False
     )
-    coupon_dates = np.array(list(coupon_schedule))
+    coupon_dates = np.array(coupon_schedule.dates(), dtype=object)
 
     print(f"Product Details:")
     print(f"Notional: ${notional:,.0f}")
@@ -298,7 +1022,7 @@ def main_example():
     }
 
     print("Pricing Athena-style Autocallable Note...")
-    athena_pv = pricer.price_autocallable_note(athena_specs, heston_process, num_paths=10000)
+    athena_pv = pricer.price_autocallable_note(athena_specs, heston_process, num_paths=8192)
 
     # Product 2: Phoenix-style (autocall at 100%, coupon at 70%)
     phoenix_specs = {
@@ -314,7 +1038,7 @@ def main_example():
     }
 
     print("Pricing Phoenix-style Autocallable Note...")
-    phoenix_pv = pricer.price_autocallable_note(phoenix_specs, heston_process, num_paths=10000)
+    phoenix_pv = pricer.price_autocallable_note(phoenix_specs, heston_process, num_paths=8192)
 
     # Calculate purchase percentages (discounted back)
     discount_rate = 0.045